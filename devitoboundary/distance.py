@@ -3,11 +3,17 @@ A module containing classes for the calculation of axial distances from signed
 distance functions discretized to a Devito grid.
 """
 
+import hashlib
+import os
+import tempfile
+
 import numpy as np
 import sympy as sp
 
 from devito import Function, VectorFunction, grad, ConditionalDimension, \
-    Le, Eq, Operator, Grid
+    Le, Eq, Operator
+from devito.logger import warning
+from devito.symbolics import CondNe
 from devitoboundary import SDFGenerator
 
 __all__ = ['SignedDistanceFunction', 'AxialDistanceFunction']
@@ -31,6 +37,9 @@ class SignedDistanceFunction:
         Flip the direction of the estimated point normals. This has the effect
         of reversing the side of the surface which is considered to be the
         interior. Default is False.
+    cache : str
+        Path to a directory in which generated signed distance functions are
+        stored for reuse. Optional.
 
     Attributes
     ----------
@@ -40,7 +49,7 @@ class SignedDistanceFunction:
         The grid onto which the signed distance function is discretized.
     """
     def __init__(self, function, infile, offset=(0., 0., 0.),
-                 toggle_normals=False):
+                 toggle_normals=False, cache=None):
         self._grid = function.grid
         # Put single functions in a tuple for consistency
         self._function = function
@@ -52,13 +61,54 @@ class SignedDistanceFunction:
         # Calculate the signed distance function
         # Radius of M/2+1 grid increments
         radius = self._order//2+1
-        self._sdfgen = SDFGenerator(infile, self._grid, radius=radius,
-                                    offset=self._offset,
-                                    toggle_normals=toggle_normals)
+        sdf_array = self._get_sdf_array(infile, radius, toggle_normals, cache)
 
         # Create a Devito function to store and manipulate the sdf
         self._sdf = Function(name='sdf', grid=self._grid, space_order=self._order)
-        self._sdf.data[:] = self._sdfgen.array
+        self._sdf.data[:] = sdf_array
+
+    def _get_sdf_array(self, infile, radius, toggle_normals, cache):
+        """
+        Get the signed distance function as an array, loading it from the cache
+        if it has previously been generated with the same configuration.
+        """
+        if cache is None:
+            return SDFGenerator(infile, self._grid, radius=radius,
+                                offset=self._offset,
+                                toggle_normals=toggle_normals).array
+
+        if not os.path.isdir(cache):
+            raise FileNotFoundError("Invalid cache location")
+
+        # Unique key for this surface and configuration
+        key = hashlib.blake2b(digest_size=16)
+        with open(infile, 'rb') as f:
+            key.update(f.read())
+        key.update(str((self._grid.shape, self._grid.extent, self._grid.origin,
+                        tuple(self._offset), toggle_normals, radius)).encode())
+        path = os.path.join(cache, key.hexdigest() + '.npy')
+
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            # Missing or unreadable (e.g. truncated) entries are regenerated
+            sdf_array = SDFGenerator(infile, self._grid, radius=radius,
+                                     offset=self._offset,
+                                     toggle_normals=toggle_normals).array
+
+        # Write to a uniquely named temporary file first, so that neither an
+        # interrupted write nor concurrent writers can leave a torn entry
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=cache, suffix='.npy.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, sdf_array)
+            os.replace(tmp, path)
+        except OSError:
+            warning("Unable to write signed distance function to cache")
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+        return sdf_array
 
     @property
     def sdf(self):
@@ -92,6 +142,9 @@ class AxialDistanceFunction(SignedDistanceFunction):
         Flip the direction of the estimated point normals. This has the effect
         of reversing the side of the surface which is considered to be the
         interior. Default is False.
+    cache : str
+        Path to a directory in which generated signed distance functions are
+        stored for reuse. Optional.
 
     Attributes
     ----------
@@ -103,15 +156,12 @@ class AxialDistanceFunction(SignedDistanceFunction):
         The axial distances to the boundary surface.
     """
     def __init__(self, function, infile, offset=(0., 0., 0.),
-                 toggle_normals=False):
+                 toggle_normals=False, cache=None):
         super().__init__(function, infile, offset=offset,
-                         toggle_normals=toggle_normals)
-
-        # Grid with M/2 nodes of padding
-        self._pad = self._pad_grid()
+                         toggle_normals=toggle_normals, cache=cache)
 
-        # Axial signed distance function (note the padded grid)
-        self._axial = VectorFunction(name='axial', grid=self._pad,
+        # Axial signed distance function
+        self._axial = VectorFunction(name='axial', grid=self._grid,
                                      space_order=self._order,
                                      staggered=(None, None, None))
 
@@ -121,100 +171,67 @@ class AxialDistanceFunction(SignedDistanceFunction):
         """
         Update the axial distance function from the signed distance function.
         """
-        # Recurring value for tidiness
-        m_size = int(self._order/2)
-
-        # Create a padded version of the signed distance function
-        pad_sdf = Function(name='pad_sdf', grid=self._pad, space_order=self._order)
-        pad_sdf.data[:] = np.pad(self._sdf.data, (m_size,), 'edge')
+        # Extend edge values of the signed distance function into its halo,
+        # which covers the M/2 points reached by the gradient stencil. This
+        # is done one axis at a time (which also fills edges and corners).
+        sdf = self._sdf
+        sdf_data = sdf.data_with_halo
+        (l_x, r_x), (l_y, r_y), (l_z, r_z) = sdf.halo
+        sdf_data[:l_x] = sdf_data[l_x:l_x+1]
+        sdf_data[-r_x:] = sdf_data[-r_x-1:-r_x]
+        sdf_data[:, :l_y] = sdf_data[:, l_y:l_y+1]
+        sdf_data[:, -r_y:] = sdf_data[:, -r_y-1:-r_y]
+        sdf_data[:, :, :l_z] = sdf_data[:, :, l_z:l_z+1]
+        sdf_data[:, :, -r_z:] = sdf_data[:, :, -r_z-1:-r_z]
+
+        x, y, z = self._grid.dimensions
+        spacing = self._grid.spacing
 
         # Set default values for axial distance
-        self._axial[0].data[:] = -self._order*self._pad.spacing[0]
-        self._axial[1].data[:] = -self._order*self._pad.spacing[1]
-        self._axial[2].data[:] = -self._order*self._pad.spacing[2]
+        for i in range(3):
+            self._axial[i].data.fill(-self._order*spacing[i])
 
         # Equations to decompose distance into axial distances
-        x, y, z = self._pad.dimensions
-        h_x, h_y, h_z = self._pad.spacing
-        pos = sp.Matrix([x*h_x, y*h_y, z*h_z])
-
-        sdf_grad = grad(pad_sdf).evaluate  # Gradient of the sdf
+        sdf_grad = grad(sdf).evaluate  # Gradient of the sdf
 
-        # Plane eq: a*x + b*y + c*z = d
-        a = sdf_grad[0]
-        b = sdf_grad[1]
-        c = sdf_grad[2]
-        d = sdf_grad.dot(pos - pad_sdf*sdf_grad)
+        # Plane eq: a*x + b*y + c*z = d, where (a, b, c) is the gradient and
+        # d = grad.(pos - sdf*grad). The distance along each axis to this plane
+        # is then (d - grad.pos)/a etc, in which the position terms cancel,
+        # leaving a numerator shared by all three axes.
+        plane_dist = -sdf*sdf_grad.dot(sdf_grad)
 
         # Only need to calculate adjacent to boundary
-        close_sdf = Le(sp.Abs(pad_sdf), h_x)
-
-        # Conditional mask for calculation
-        mask = ConditionalDimension(name='mask', parent=z,
-                                    condition=close_sdf)
-
-        eq_x = Eq(self._axial[0], (d - b*pos[1] - c*pos[2])/a - pos[0], implicit_dims=mask)
-        eq_y = Eq(self._axial[1], (d - a*pos[0] - c*pos[2])/b - pos[1], implicit_dims=mask)
-        eq_z = Eq(self._axial[2], (d - a*pos[0] - b*pos[1])/c - pos[2], implicit_dims=mask)
-
-        op_axial = Operator([eq_x, eq_y, eq_z],
-                            name='Axial')
-        op_axial.apply()
-
-        # Deal with silly values x
-        x_nan_mask = np.isnan(self._axial[0].data)
-        self._axial[0].data[x_nan_mask] = -self._order*h_x
-        x_big_mask = np.abs(self._axial[0].data) > h_x
-        self._axial[0].data[x_big_mask] = -self._order*h_x
-
-        # Deal with silly values y
-        y_nan_mask = np.isnan(self._axial[1].data)
-        self._axial[1].data[y_nan_mask] = -self._order*h_y
-        y_big_mask = np.abs(self._axial[1].data) > h_y
-        self._axial[1].data[y_big_mask] = -self._order*h_y
-
-        # Deal with silly values z
-        z_nan_mask = np.isnan(self._axial[2].data)
-        self._axial[2].data[z_nan_mask] = -self._order*h_z
-        z_big_mask = np.abs(self._axial[2].data) > h_z
-        self._axial[2].data[z_big_mask] = -self._order*h_z
-
-    def _pad_grid(self):
-        """
-        Return a grid with an additional M/2 nodes of padding on each side vs
-        the main grid.
-        """
-        # Recurring value for tidiness
-        m_size = int(self._order/2)
-        # Calculate origin position
-        p_origin = np.array([value for value in self._grid.origin_map.values()])
-        p_origin -= m_size*np.array(self._grid.spacing)
-        p_origin = tuple(p_origin)
-        # Calculate size and extent of the padded grid
-        p_extent = np.array(self._grid.extent)
-        p_extent += 2*m_size*np.array(self._grid.spacing)
-        p_extent = tuple(p_extent)
-        p_shape = np.array(self._grid.shape)+2*m_size
-        p_shape = tuple(p_shape)
-
-        p_grid = Grid(shape=p_shape, extent=p_extent, origin=p_origin)
-
-        return p_grid
+        close_sdf = Le(sp.Abs(sdf), spacing[0])
+
+        eqs = []
+        for i, (dim, h_i) in enumerate(zip((x, y, z), spacing)):
+            axial_dist = plane_dist/sdf_grad[i]
+            # Only write valid distances within a grid increment of the
+            # boundary, leaving the default value everywhere else
+            valid = sp.And(close_sdf, CondNe(sdf_grad[i], 0),
+                           Le(sp.Abs(axial_dist), h_i))
+            mask = ConditionalDimension(name='mask_'+dim.name, parent=z,
+                                        condition=valid)
+            eqs.append(Eq(self._axial[i], axial_dist, implicit_dims=mask))
+
+        op_axial = Operator(eqs, name='Axial')
+
+        # Restrict the iteration space to the box containing the points close
+        # to the boundary, so the masked loop doesn't sweep the whole grid
+        close_data = np.abs(self._sdf.data) <= spacing[0]
+        bounds = {}
+        for i, dim in enumerate(self._grid.dimensions):
+            others = tuple(j for j in range(3) if j != i)
+            close_inds = np.nonzero(np.any(close_data, axis=others))[0]
+            if close_inds.size != 0:
+                bounds[dim.min_name] = close_inds[0]
+                bounds[dim.max_name] = close_inds[-1]
+
+        # Skip the operator entirely if no points are adjacent to the boundary
+        if len(bounds) != 0:
+            op_axial.apply(**bounds)
 
     @property
     def axial(self):
         """Get the axial distances"""
-        m_size = int(self._order/2)
-        axial = VectorFunction(name='axial', grid=self._grid,
-                               space_order=self._order,
-                               staggered=(None, None, None))
-        axial[0].data[:] = self._axial[0].data[m_size:-m_size,
-                                               m_size:-m_size,
-                                               m_size:-m_size]
-        axial[1].data[:] = self._axial[1].data[m_size:-m_size,
-                                               m_size:-m_size,
-                                               m_size:-m_size]
-        axial[2].data[:] = self._axial[2].data[m_size:-m_size,
-                                               m_size:-m_size,
-                                               m_size:-m_size]
-        return axial
+        return self._axial
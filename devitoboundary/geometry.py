@@ -5,11 +5,17 @@ Contains various geometric utilities.
 """
 
 import os
-import vtk
 
 import numpy as np
 
-from vtk.numpy_interface import dataset_adapter as dsa
+# Import only the VTK modules used, rather than the whole of vtk
+try:
+    from vtkmodules.vtkIOPLY import vtkPLYReader
+    from vtkmodules.vtkFiltersPoints import vtkPCANormalEstimation, vtkSignedDistance
+    from vtkmodules.numpy_interface import dataset_adapter as dsa
+except ImportError:  # VTK < 8.2
+    from vtk import vtkPLYReader, vtkPCANormalEstimation, vtkSignedDistance
+    from vtk.numpy_interface import dataset_adapter as dsa
 
 
 __all__ = ['PolyReader', 'NormalCalculator', 'SDFGenerator']
@@ -40,7 +46,7 @@ class PolyReader:
         _, ext = os.path.splitext(self._file)
 
         if ext == '.ply':
-            self._reader = vtk.vtkPLYReader()
+            self._reader = vtkPLYReader()
         else:
             read_err = "Files of type {} are currently unsupported"
             raise NotImplementedError(read_err.format(ext))
@@ -89,7 +95,7 @@ class NormalCalculator:
         Return the VTK output port of the reader
     """
     def __init__(self, input, toggle_normals, sample):
-        self._norms = vtk.vtkPCANormalEstimation()
+        self._norms = vtkPCANormalEstimation()
         self._norms.SetInputConnection(input.GetOutputPort())
         self._norms.SetSampleSize(sample)
 
@@ -152,7 +158,7 @@ class SDFGenerator:
         self._reader = PolyReader(infile)
         self._norms = NormalCalculator(self._reader, toggle_normals, sample)
 
-        self._dist = vtk.vtkSignedDistance()
+        self._dist = vtkSignedDistance()
         self._dist.SetInputConnection(self._norms.GetOutputPort())
 
         self._dist.SetRadius(radius*grid.spacing[0])
@@ -8,14 +8,14 @@ import pandas as pd
 import numpy as np
 
 from devito import Coefficient, Dimension, Function
-from devitoboundary import __file__
+from devito.logger import debug
 from devitoboundary.stencils.stencils import get_stencils_lambda
 from devitoboundary.stencils.stencil_utils import standard_stencil, get_grid_offset
 
 _feps = np.finfo(np.float32).eps  # Get the eps
 
 
-def find_boundary_points(data):
+def find_boundary_points(data, fill_val=None):
     """
     Find points immediately adjacent to boundary and return their locations.
 
@@ -23,6 +23,9 @@ def find_boundary_points(data):
     ----------
     data : ndarray
         The distance function for a particular axis
+    fill_val : float
+        The filler value of the distance function. Found from the data if not
+        supplied.
 
     Returns
     -------
@@ -31,13 +34,16 @@ def find_boundary_points(data):
         adjacent" refers to points where the distance function is not at its
         filler values).
     """
-    fill_val = np.amin(data)  # Filler value for the distance function
-    x, y, z = np.where(data != fill_val)
+    if fill_val is None:
+        fill_val = np.amin(data)  # Filler value for the distance function
+    # Boundary-adjacent points are sparse, so finding their flat indices and
+    # unravelling them is much cheaper than np.where on the 3D mask
+    x, y, z = np.unravel_index(np.flatnonzero(data != fill_val), data.shape)
 
     return x, y, z
 
 
-def build_dataframe(data, spacing):
+def build_dataframe(data, spacing, points=None):
     """
     Return a dataframe with columns x, y, z, eta
 
@@ -47,65 +53,120 @@ def build_dataframe(data, spacing):
         The distance function for a particular axis
     spacing : float
         The spacing of the grid
+    points : tuple of ndarray
+        The x, y, and z indices of boundary adjacent points, as returned by
+        find_boundary_points. Found from the data if not supplied.
 
     Returns
     -------
     points : pandas DataFrame
         The dataframe of points and their respective eta values
     """
-    x, y, z = find_boundary_points(data)
+    if points is None:
+        points = find_boundary_points(data)
+    x, y, z = points
 
     eta = data[x, y, z]
 
-    col_x = pd.Series(x.astype(np.int), name='x')
-    col_y = pd.Series(y.astype(np.int), name='y')
-    col_z = pd.Series(z.astype(np.int), name='z')
+    points = pd.DataFrame({'x': x.astype(np.int32, copy=False),
+                           'y': y.astype(np.int32, copy=False),
+                           'z': z.astype(np.int32, copy=False),
+                           'eta_l': np.where(eta <= 0, eta/spacing, np.NaN),
+                           'eta_r': np.where(eta >= 0, eta/spacing, np.NaN)})
+    return points
 
-    eta_r = pd.Series(np.where(eta >= 0, eta/spacing, np.NaN), name='eta_r')
-    eta_l = pd.Series(np.where(eta <= 0, eta/spacing, np.NaN), name='eta_1')
 
-    frame = {'x': col_x, 'y': col_y, 'z': col_z, 'eta_l': eta_l, 'eta_r': eta_r}
-    points = pd.DataFrame(frame)
-    return points
+def consolidate_points(df, reduce_l=np.fmin, reduce_r=np.fmin):
+    """
+    Consolidate points which appear more than once in a dataframe, reducing
+    their eta values. Points are sorted and duplicates reduced in a single
+    pass, with NaN values ignored unless no other value is present.
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        The dataframe of points to consolidate
+    reduce_l : numpy ufunc
+        The reduction to apply to duplicate left-side eta values. Default is
+        np.fmin.
+    reduce_r : numpy ufunc
+        The reduction to apply to duplicate right-side eta values. Default is
+        np.fmin.
+
+    Returns
+    -------
+    consolidated : pandas DataFrame
+        The dataframe of unique points, indexed by z, y, and x
+    """
+    # Reciprocals can lie outside the grid, so make positions non-negative
+    x, y, z = (df[dim].to_numpy().astype(np.int64) for dim in ('x', 'y', 'z'))
+    x, y, z = (pos - np.amin(pos, initial=0) for pos in (x, y, z))
+
+    # Pack each point into a single integer key ordered by z, then y, then x
+    keys = (z*(np.amax(y, initial=0) + 1) + y)*(np.amax(x, initial=0) + 1) + x
+
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    # Where each unique point starts
+    starts = np.flatnonzero(np.diff(keys, prepend=-1))
+    first = order[starts]
+
+    eta_l = reduce_l.reduceat(df.eta_l.to_numpy()[order], starts)
+    eta_r = reduce_r.reduceat(df.eta_r.to_numpy()[order], starts)
+
+    index = pd.MultiIndex.from_arrays((df.z.to_numpy()[first],
+                                       df.y.to_numpy()[first],
+                                       df.x.to_numpy()[first]),
+                                      names=('z', 'y', 'x'))
+
+    return pd.DataFrame({'eta_l': eta_l, 'eta_r': eta_r}, index=index)
 
 
 def apply_grid_offset(df, axis, offset):
     """
-    Shift eta values according to grid offset. Carried out in place
+    Shift eta values according to grid offset. The shift is carried out in
+    place, with the consolidated points returned.
     """
-    df.eta_l -= offset
-    df.eta_r -= offset
+    eta_l = df.eta_l.to_numpy() - offset
+    eta_r = df.eta_r.to_numpy() - offset
+    position = df[axis].to_numpy()
 
     if np.sign(offset) == 1:
-        eta_r_mask = df.eta_r < 0
-        eta_l_mask = df.eta_l <= -1
+        eta_r_mask = eta_r < 0
+        eta_l_mask = eta_l <= -1
 
-        df.loc[eta_r_mask, 'eta_l'] = df.eta_r[eta_r_mask]
-        df.loc[eta_r_mask, 'eta_r'] = np.NaN
+        eta_l = np.where(eta_r_mask, eta_r, eta_l)
+        eta_r = np.where(eta_r_mask, np.NaN, eta_r)
 
-        df.loc[eta_l_mask, 'eta_l'] += 1
+        eta_l = np.where(eta_l_mask, eta_l + 1, eta_l)
 
-        df.loc[eta_l_mask, axis] -= 1
+        position = position - eta_l_mask
 
     elif np.sign(offset) == -1:
-        eta_r_mask = df.eta_r > 1
-        eta_l_mask = df.eta_l >= 0
+        eta_r_mask = eta_r > 1
+        eta_l_mask = eta_l >= 0
+
+        eta_r = np.where(eta_l_mask, eta_l, eta_r)
+        eta_l = np.where(eta_l_mask, np.NaN, eta_l)
 
-        df.loc[eta_l_mask, 'eta_r'] = df.eta_l[eta_l_mask]
-        df.loc[eta_l_mask, 'eta_l'] = np.NaN
+        eta_r = np.where(eta_r_mask, eta_r - 1, eta_r)
 
-        df.loc[eta_r_mask, 'eta_r'] -= 1
+        position = position + eta_r_mask
 
-        df.loc[eta_r_mask, axis] += 1
+    # Write the shifted values back to the dataframe
+    df['eta_l'] = eta_l
+    df['eta_r'] = eta_r
+    df[axis] = position
 
     # Aggregate and reset the index to undo the grouping
-    df = df.groupby(['z', 'y', 'x']).agg({'eta_l': 'max', 'eta_r': 'min'}).reset_index()
+    df = consolidate_points(df, reduce_l=np.fmax).reset_index()
 
     # Make sure zero distances appear on both sides
-    l_zero_mask = df.eta_l == 0
-    r_zero_mask = df.eta_r == 0
-    df.loc[l_zero_mask, 'eta_r'] = 0
-    df.loc[r_zero_mask, 'eta_l'] = 0
+    eta_l = df.eta_l.to_numpy()
+    eta_r = df.eta_r.to_numpy()
+    df['eta_l'] = np.where(eta_r == 0, 0, eta_l)
+    df['eta_r'] = np.where(eta_l == 0, 0, eta_r)
     return df
 
 
@@ -132,15 +193,16 @@ def calculate_reciprocals(df, axis, side):
     other = 'eta_r' if side == 'l' else 'eta_l'  # Other side
     column = 'eta_' + side
 
-    reciprocals = df[pd.notna(df[column])].copy()
-    reciprocals[axis] += increment
+    known = pd.notna(df[column]).to_numpy()
+    reciprocals = {name: df[name].to_numpy()[known] for name in df.columns}
+    reciprocals[axis] = reciprocals[axis] + increment
     reciprocals[other] = reciprocals[column] - increment
-    reciprocals[column] = np.NaN
+    reciprocals[column] = np.full(np.count_nonzero(known), np.NaN)
 
-    return reciprocals
+    return pd.DataFrame(reciprocals, columns=df.columns)
 
 
-def get_data_inc_reciprocals(data, spacing, axis, offset):
+def get_data_inc_reciprocals(data, spacing, axis, offset, points=None):
     """
     Calculate and consolidate reciprocal values, returning resultant dataframe.
 
@@ -154,6 +216,8 @@ def get_data_inc_reciprocals(data, spacing, axis, offset):
         The specified axis
     offset : float
         The grid offset for this axis
+    points : tuple of ndarray
+        The x, y, and z indices of boundary adjacent points. Optional.
 
     Returns
     -------
@@ -161,17 +225,17 @@ def get_data_inc_reciprocals(data, spacing, axis, offset):
         Dataframe of points including reciprocal distances, consolidated down
     """
 
-    df = build_dataframe(data, spacing)
+    df = build_dataframe(data, spacing, points=points)
 
     df = apply_grid_offset(df, axis, offset)
 
     reciprocals_l = calculate_reciprocals(df, axis, 'l')
     reciprocals_r = calculate_reciprocals(df, axis, 'r')
 
-    full_df = df.append([reciprocals_l, reciprocals_r])
+    full_df = pd.concat([df, reciprocals_l, reciprocals_r], ignore_index=True)
 
     # Group and aggregate to consolidate points doubled up by this process
-    aggregated_data = full_df.groupby(['z', 'y', 'x']).agg({'eta_l': 'min', 'eta_r': 'min'})
+    aggregated_data = consolidate_points(full_df)
 
     return aggregated_data
 
@@ -181,6 +245,45 @@ def add_distance_column(data):
     data['dist'] = 0
 
 
+def get_line_ends(data, axis, levels):
+    """
+    Get masks for the first and last points along each grid line parallel to
+    the specified axis. Points are sorted such that each line is a contiguous
+    run, with the ends of each run marking the ends of the line.
+
+    Parameters
+    ----------
+    data : pandas DataFrame
+        The dataframe containing the points
+    axis : str
+        The axis along which the lines are orientated
+    levels : list of str
+        The remaining two index levels, which identify each line
+
+    Returns
+    -------
+    first_mask, last_mask : ndarray
+        Boolean masks for the heads and tails of the lines
+    """
+    key_0 = data.index.get_level_values(levels[0]).to_numpy()
+    key_1 = data.index.get_level_values(levels[1]).to_numpy()
+    position = data.index.get_level_values(axis).to_numpy()
+
+    order = np.lexsort((position, key_1, key_0))
+    key_0 = key_0[order]
+    key_1 = key_1[order]
+
+    # Where one line ends and the next starts
+    new_line = np.logical_or(key_0[1:] != key_0[:-1], key_1[1:] != key_1[:-1])
+
+    first_mask = np.empty(len(order), dtype=bool)
+    last_mask = np.empty(len(order), dtype=bool)
+    first_mask[order] = np.concatenate(([True], new_line))[:len(order)]
+    last_mask[order] = np.concatenate((new_line, [True]))[:len(order)]
+
+    return first_mask, last_mask
+
+
 def split_types(data, axis, axis_size):
     """
     Splits points into the five categories:
@@ -210,42 +313,104 @@ def split_types(data, axis, axis_size):
     levels = ['z', 'y', 'x']
     levels.remove(axis)
 
-    # FIXME: Can copies be removed?
-    first = data.groupby(level=levels).head(1).copy()  # Get head
-    last = data.groupby(level=levels).tail(1).copy()  # Get tail
+    # Work with positional masks rather than dropping rows by index label
+    first_mask, last_mask = get_line_ends(data, axis, levels)
 
-    double_cond = np.logical_and(pd.notna(data.eta_l),
-                                 pd.notna(data.eta_r))
-    double = data[double_cond]  # Get double-sided
+    eta_l_mask = pd.notna(data.eta_l).to_numpy()
+    eta_r_mask = pd.notna(data.eta_r).to_numpy()
+    double_mask = np.logical_and(eta_l_mask, eta_r_mask)  # Get double-sided
 
-    f_index = first.index  # Get the indices of the easy categories
-    l_index = last.index
-    d_index = double.index
+    # Paired points are whatever remains
+    paired_mask = ~(first_mask | last_mask | double_mask)
 
-    paired = data.drop(f_index).drop(l_index).drop(d_index)  # Remove these bits
-    paired_left = paired[pd.notna(paired.eta_l)].copy()
-    paired_right = paired[pd.notna(paired.eta_r)].copy()
+    # Drop any values outside computational domain (generated by reciprocity)
+    # Needs to be done after the paired mask or invalid values end up in the
+    # paired categories
+    position = data.index.get_level_values(axis).to_numpy()
+    first_mask &= position >= 0
+    last_mask &= position < axis_size
+
+    # Take each category by row number, so that each is only copied once
+    first = data.take(np.flatnonzero(first_mask))
+    last = data.take(np.flatnonzero(last_mask))
+    double = data.take(np.flatnonzero(double_mask))
+    paired_left = data.take(np.flatnonzero(paired_mask & eta_l_mask))
+    paired_right = data.take(np.flatnonzero(paired_mask & eta_r_mask))
 
     # Paired points in paired_left and paired_right match up
-    paired_dist = (paired_right.index.get_level_values(axis).to_numpy()
-                   - paired_left.index.get_level_values(axis).to_numpy())
+    paired_dist = position[paired_mask & eta_r_mask] - position[paired_mask & eta_l_mask]
     paired_left.dist = paired_dist
     paired_right.dist = -paired_dist
 
     paired_left.eta_r = paired_right.eta_r.to_numpy()  # Ugly, since in most cases these wouldn't fit together
     paired_right.eta_l = paired_left.eta_l.to_numpy()
 
-    first.dist = -f_index.get_level_values(axis).to_numpy()
-    last.dist = axis_size - 1 - l_index.get_level_values(axis).to_numpy()
-
-    # Drop any values outside computational domain (generated by reciprocity)
-    # Needs to be done after the drop or invalid values end up in the paired categories
-    first = first[first.index.get_level_values(axis) >= 0]
-    last = last[last.index.get_level_values(axis) < axis_size]
+    first.dist = -position[first_mask]
+    last.dist = axis_size - 1 - position[last_mask]
 
     return first, last, double, paired_left, paired_right
 
 
+def evaluate_variants(eta_left, eta_right, left_variants, right_variants,
+                      stencil_lambda, stencils):
+    """
+    Evaluate the stencil variants present in a set of stencils, filling the
+    stencil array in place. Stencils are bucketed by variant so that each
+    variant is only evaluated once for all the stencils which use it.
+
+    Parameters
+    ----------
+    eta_left : ndarray or float
+        The left-side eta values for each of the stencils
+    eta_right : ndarray or float
+        The right-side eta values for each of the stencils
+    left_variants: ndarray
+        The left-side stencil variants for each of the stencils
+    right_variants: ndarray
+        The right-side stencil variants for each of the stencils
+    stencil_lambda : ndarray
+        The functions for stencils to be evaluated
+    stencils : ndarray
+        The array of stencil coefficients to fill
+    """
+    # Stencils with invalid variant numbers are left at zero
+    valid = np.logical_and(np.isfinite(left_variants),
+                           np.isfinite(right_variants))
+
+    eta_left = np.broadcast_to(eta_left, valid.shape)[valid]
+    eta_right = np.broadcast_to(eta_right, valid.shape)[valid]
+
+    # Key each stencil by its variant pair and sort so that each variant
+    # occupies a contiguous block
+    left_variants = left_variants[valid].astype(int)
+    right_variants = right_variants[valid].astype(int)
+    n_right = np.amax(right_variants, initial=0) + 1
+    keys = left_variants*n_right + right_variants
+    order = np.argsort(keys)
+    keys = keys[order]
+    eta_left = eta_left[order]
+    eta_right = eta_right[order]
+
+    bucket_starts = np.flatnonzero(np.diff(keys, prepend=-1))
+    bucket_ends = np.append(bucket_starts[1:], keys.size)
+    unique_variants = np.stack(np.divmod(keys[bucket_starts], n_right), axis=-1)
+
+    evaluated = np.zeros((eta_left.size, stencils.shape[-1]), dtype=stencils.dtype)
+
+    for (left_var, right_var), start, end in zip(unique_variants,
+                                                 bucket_starts, bucket_ends):
+        bucket_left = eta_left[start:end]
+        bucket_right = eta_right[start:end]
+        for coeff in range(stencils.shape[-1]):
+            func = stencil_lambda[left_var, right_var, coeff]
+            evaluated[start:end, coeff] = func(bucket_left, bucket_right)
+
+    # Return the stencils to their original order in one go
+    unsorted = np.empty_like(evaluated)
+    unsorted[order] = evaluated
+    stencils[valid] = unsorted
+
+
 def evaluate_stencils(df, point_type, n_stencils, left_variants, right_variants,
                       space_order, stencil_lambda):
     """
@@ -259,9 +424,9 @@ def evaluate_stencils(df, point_type, n_stencils, left_variants, right_variants,
     point_type : string
         The category of the points. Can be 'first', 'last', 'double',
         'paired_left', or 'paired_right'.
-    n_stencils : int
-        The number of stencils associated with each point. Each point must have
-        the same number of stencils associated with it.
+    n_stencils : int or ndarray
+        The number of stencils associated with each point. Can be given per
+        point as a column, with variants for unused stencils set to NaN.
     left_variants: ndarray
         The left-side stencil variants for each of the stencils
     right_variants: ndarray
@@ -277,75 +442,38 @@ def evaluate_stencils(df, point_type, n_stencils, left_variants, right_variants,
         The evaluated stencil coefficients
     """
     # The base "index" for eta
-    eta_base = np.tile(np.arange(n_stencils), (left_variants.shape[0], 1))
+    eta_base = np.arange(left_variants.shape[-1])
     # Initialise empty stencil array
     stencils = np.zeros(left_variants.shape + (space_order + 1,), dtype=np.float32)
 
+    eta_l = df.eta_l.to_numpy()[:, np.newaxis]
+    eta_r = df.eta_r.to_numpy()[:, np.newaxis]
+
+    # Shift the etas of each point to be relative to each of its stencils
     if point_type == 'first':
-        eta_right = np.tile(df.eta_r.to_numpy()[:, np.newaxis],
-                            (1, n_stencils)) + n_stencils - eta_base - 1
-
-        for right_var in range(space_order+1):
-            mask = right_variants == right_var
-            for coeff in range(space_order+1):
-                func = stencil_lambda[0, right_var, coeff]
-                stencils[mask, coeff] = func(0, eta_right[mask])
-
-    if point_type == 'last':
-        eta_left = np.tile(df.eta_l.to_numpy()[:, np.newaxis],
-                           (1, n_stencils)) - eta_base
-
-        for left_var in range(space_order+1):
-            mask = left_variants == left_var
-            for coeff in range(space_order+1):
-                func = stencil_lambda[left_var, 0, coeff]
-                stencils[mask, coeff] = func(eta_left[mask], 0)
-
-    if point_type == 'double':
-        eta_left = df.eta_l.to_numpy()[:, np.newaxis]
-        eta_right = df.eta_r.to_numpy()[:, np.newaxis]
-
-        for left_var in range(space_order+1):
-            for right_var in range(space_order+1):
-                mask = np.logical_and(left_variants == left_var,
-                                      right_variants == right_var)
-                for coeff in range(space_order+1):
-                    func = stencil_lambda[left_var, right_var, coeff]
-                    stencils[mask, coeff] = func(eta_left[mask],
-                                                 eta_right[mask])
-
-    if point_type == 'paired_left':
+        eta_left = 0
+        eta_right = eta_r + n_stencils - eta_base - 1
+    elif point_type == 'last':
+        eta_left = eta_l - eta_base
+        eta_right = 0
+    elif point_type == 'double':
+        eta_left = eta_l
+        eta_right = eta_r
+    elif point_type == 'paired_left':
         dst = df.dist.to_numpy()[:, np.newaxis]
-        eta_left = np.tile(df.eta_l.to_numpy()[:, np.newaxis],
-                           (1, n_stencils)) - eta_base
-        eta_right = np.tile(df.eta_r.to_numpy()[:, np.newaxis],
-                            (1, n_stencils)) + dst - eta_base
-
-        for left_var in range(space_order+1):
-            for right_var in range(space_order+1):
-                mask = np.logical_and(left_variants == left_var,
-                                      right_variants == right_var)
-                for coeff in range(space_order+1):
-                    func = stencil_lambda[left_var, right_var, coeff]
-                    stencils[mask, coeff] = func(eta_left[mask],
-                                                 eta_right[mask])
-
-    if point_type == 'paired_right':
+        eta_left = eta_l - eta_base
+        eta_right = eta_r + dst - eta_base
+    elif point_type == 'paired_right':
         dst = df.dist.to_numpy()[:, np.newaxis]
         # dst used to have a minus (this was wrong)
-        eta_left = np.tile(df.eta_l.to_numpy()[:, np.newaxis],
-                           (1, n_stencils)) + n_stencils + dst - eta_base - 1
-        eta_right = np.tile(df.eta_r.to_numpy()[:, np.newaxis],
-                            (1, n_stencils)) + n_stencils - eta_base - 1
-
-        for left_var in range(space_order+1):
-            for right_var in range(space_order+1):
-                mask = np.logical_and(left_variants == left_var,
-                                      right_variants == right_var)
-                for coeff in range(space_order+1):
-                    func = stencil_lambda[left_var, right_var, coeff]
-                    stencils[mask, coeff] = func(eta_left[mask],
-                                                 eta_right[mask])
+        eta_left = eta_l + n_stencils + dst - eta_base - 1
+        eta_right = eta_r + n_stencils - eta_base - 1
+    else:
+        raise ValueError("Invalid point type")
+
+    evaluate_variants(eta_left, eta_right, left_variants, right_variants,
+                      stencil_lambda, stencils)
+
     return stencils
 
 
@@ -367,38 +495,30 @@ def fill_weights(points, stencils, point_type, weights, axis, n_pts=1):
     axis : str
         The axis along which the stencils are orientated. Can be 'x', 'y', or
         'z'.
-    n_pts : int
-        The number of stencils associated with each point. Each point must have
-        the same number of stencils associated with it.
+    n_pts : int or ndarray
+        The number of stencils associated with each point. Can be given per
+        point, in which case any further stencils for a point are ignored.
     """
     x = points.index.get_level_values('x').values
     y = points.index.get_level_values('y').values
     z = points.index.get_level_values('z').values
 
+    n_pts = np.broadcast_to(n_pts, x.shape)
+    axis_index = ('x', 'y', 'z').index(axis)
+
+    # Every stencil slot in use, as (point, slot) pairs
+    point, slot = np.nonzero(np.arange(stencils.shape[1]) < n_pts[:, np.newaxis])
+
+    indices = [x[point], y[point], z[point]]
     if point_type == 'first' or point_type == 'paired_right':
-        if axis == 'x':
-            for i in range(n_pts):
-                weights.data[x-n_pts+1+i, y, z] = stencils[:, i, :]
-        elif axis == 'y':
-            for i in range(n_pts):
-                weights.data[x, y-n_pts+1+i, z] = stencils[:, i, :]
-        elif axis == 'z':
-            for i in range(n_pts):
-                weights.data[x, y, z-n_pts+1+i] = stencils[:, i, :]
-
-    elif point_type == 'last' or point_type == 'paired_left':
-        if axis == 'x':
-            for i in range(n_pts):
-                weights.data[x+i, y, z] = stencils[:, i, :]
-        elif axis == 'y':
-            for i in range(n_pts):
-                weights.data[x, y+i, z] = stencils[:, i, :]
-        elif axis == 'z':
-            for i in range(n_pts):
-                weights.data[x, y, z+i] = stencils[:, i, :]
+        indices[axis_index] += 1 + slot - n_pts[point]
+    elif point_type in ('last', 'paired_left', 'double'):
+        indices[axis_index] += slot
+    else:
+        raise ValueError("Invalid point type")
 
-    elif point_type == 'double':
-        weights.data[x, y, z] = stencils[:, 0, :]
+    # Store all the stencils at once
+    weights.data[tuple(indices)] = stencils[point, slot]
 
 
 def get_variants(df, space_order, point_type, axis, stencils, weights):
@@ -423,66 +543,40 @@ def get_variants(df, space_order, point_type, axis, stencils, weights):
     weights : devito Function
         The Function to fill with stencil coefficients
     """
+    if len(df.index) == 0:
+        return  # No points of this type
+
     if point_type == 'first':
-        n_pts = np.minimum(int(space_order/2), 1-df.dist.to_numpy())
+        n_pts = np.minimum(space_order//2, 1-df.dist.to_numpy())
         # Modifier for points which lie within half a grid spacing of the boundary
         modifier_right = np.where(df.eta_r.to_numpy() - 0.5 < _feps, 0, 1)
 
         # Starting point for the right stencil (moving from left to right)
         start_right = space_order-2*(n_pts-1)-modifier_right
 
-        i_min = np.amin(n_pts)
-        i_max = np.amax(n_pts)
-
-        for i in np.linspace(i_min, i_max, 1+i_max-i_min, dtype=int):
-            mask = n_pts == i
-            mask_size = np.count_nonzero(mask)
-            left_variants = np.zeros((mask_size, i), dtype=int)
-
-            # This is capped at space_order to prevent invalid variant numbers
-            right_variants = np.minimum(np.tile(2*np.arange(i), (mask_size, 1))
-                                        + start_right[mask, np.newaxis],
-                                        space_order)
-
-            # Iterate over left and right variants
-            eval_stencils = evaluate_stencils(df[mask], 'first', i,
-                                              left_variants, right_variants,
-                                              space_order, stencils)
+        slots = np.arange(np.amax(n_pts))
+        left_variants = np.zeros((len(n_pts), len(slots)), dtype=int)
 
-            # Insert the stencils into the weight function
-            fill_weights(df[mask], eval_stencils, 'first',
-                         weights, axis, n_pts=i)
+        # This is capped at space_order to prevent invalid variant numbers
+        right_variants = np.minimum(2*slots + start_right[:, np.newaxis],
+                                    space_order)
 
     elif point_type == 'last':
-        n_pts = np.minimum(int(space_order/2), 1+df.dist.to_numpy())
+        n_pts = np.minimum(space_order//2, 1+df.dist.to_numpy())
         # Modifier for points which lie within half a grid spacing of the boundary
         modifier_left = np.where(df.eta_l.to_numpy() - -0.5 > _feps, 0, 1)
 
         start_left = space_order-modifier_left
 
-        i_min = np.amin(n_pts)
-        i_max = np.amax(n_pts)
-        for i in np.linspace(i_min, i_max, 1+i_max-i_min, dtype=int):
-            mask = n_pts == i
-            mask_size = np.count_nonzero(mask)
-            # This is capped at space_order to prevent invalid variant numbers
-            left_variants = np.minimum(np.tile(-2*np.arange(i), (mask_size, 1))
-                                       + start_left[mask, np.newaxis],
-                                       space_order)
-
-            right_variants = np.zeros((mask_size, i), dtype=int)
-
-            # Iterate over left and right variants
-            eval_stencils = evaluate_stencils(df[mask], 'last', i,
-                                              left_variants, right_variants,
-                                              space_order, stencils)
+        slots = np.arange(np.amax(n_pts))
+        # This is capped at space_order to prevent invalid variant numbers
+        left_variants = np.minimum(-2*slots + start_left[:, np.newaxis],
+                                   space_order)
 
-            # Insert the stencils into the weight function
-            fill_weights(df[mask], eval_stencils, 'last',
-                         weights, axis, n_pts=i)
+        right_variants = np.zeros((len(n_pts), len(slots)), dtype=int)
 
     elif point_type == 'double':
-        n_pts = 1
+        n_pts = np.ones(len(df.index), dtype=int)
         # Modifier for points which lie within half a grid spacing of the boundary
         modifier_left = np.where(df.eta_l.to_numpy() - -0.5 > _feps, 0, 1)
         modifier_right = np.where(df.eta_r.to_numpy() - 0.5 < _feps, 0, 1)
@@ -497,20 +591,13 @@ def get_variants(df, space_order, point_type, axis, stencils, weights):
         start_left = space_order-modifier_left+modifier_zero
         start_right = space_order-modifier_right+modifier_zero
 
+        slots = np.arange(1)
         # This is capped at space_order to prevent invalid variant numbers
         left_variants = np.minimum(start_left[:, np.newaxis], space_order)
         right_variants = np.minimum(start_right[:, np.newaxis], space_order)
 
-        # Iterate over left and right variants
-        eval_stencils = evaluate_stencils(df, 'double', 1,
-                                          left_variants, right_variants,
-                                          space_order, stencils)
-
-        # Insert the stencils into the weight function
-        fill_weights(df, eval_stencils, 'double', weights, axis)
-
     elif point_type == 'paired_left':
-        n_pts = np.minimum(int(space_order/2), df.dist.to_numpy())
+        n_pts = np.minimum(space_order//2, df.dist.to_numpy())
         # Modifier for points which lie within half a grid spacing of the boundary
         modifier_left = np.where(df.eta_l.to_numpy() - -0.5 > _feps, 0, 1)
         modifier_right = np.where(df.eta_r.to_numpy() - 0.5 < _feps, 0, 1)
@@ -518,30 +605,16 @@ def get_variants(df, space_order, point_type, axis, stencils, weights):
         start_left = space_order-modifier_left
         start_right = space_order-2*df.dist.to_numpy()-modifier_right
 
-        i_min = np.amin(n_pts)
-        i_max = np.amax(n_pts)
-        for i in np.linspace(i_min, i_max, 1+i_max-i_min, dtype=int):
-            mask = n_pts == i
-            mask_size = np.count_nonzero(mask)
-            # This is capped at space_order to prevent invalid variant numbers
-            left_variants = np.minimum(np.tile(-2*np.arange(i), (mask_size, 1))
-                                       + start_left[mask, np.newaxis],
-                                       space_order)
-            right_variants = np.minimum(np.maximum(np.tile(2*np.arange(i), (mask_size, 1))
-                                                   + start_right[mask, np.newaxis], 0),
-                                        space_order)
-
-            # Iterate over left and right variants
-            eval_stencils = evaluate_stencils(df[mask], 'paired_left', i,
-                                              left_variants, right_variants,
-                                              space_order, stencils)
-            # Insert the stencils into the weight function
-            fill_weights(df[mask], eval_stencils, 'paired_left',
-                         weights, axis, n_pts=i)
+        slots = np.arange(np.amax(n_pts))
+        # This is capped at space_order to prevent invalid variant numbers
+        left_variants = np.minimum(-2*slots + start_left[:, np.newaxis],
+                                   space_order)
+        right_variants = np.minimum(np.maximum(2*slots + start_right[:, np.newaxis], 0),
+                                    space_order)
 
     elif point_type == 'paired_right':
-        n_pts = np.minimum(int(space_order/2),
-                           1-df.dist.to_numpy()-np.minimum(int(space_order/2),
+        n_pts = np.minimum(space_order//2,
+                           1-df.dist.to_numpy()-np.minimum(space_order//2,
                                                            -df.dist.to_numpy()))
         # Modifier for points which lie within half a grid spacing of the boundary
         modifier_left = np.where(df.eta_l.to_numpy() - -0.5 > _feps, 0, 1)
@@ -550,30 +623,33 @@ def get_variants(df, space_order, point_type, axis, stencils, weights):
         start_left = space_order+2*df.dist.to_numpy()-modifier_left
         start_right = space_order-2*(n_pts-1)-modifier_right
 
-        i_min = np.amin(n_pts)
-        i_max = np.amax(n_pts)
-        for i in np.linspace(i_min, i_max, 1+i_max-i_min, dtype=int):
-            mask = n_pts == i
-            mask_size = np.count_nonzero(mask)
-            # This is capped at space_order to prevent invalid variant numbers
-            left_variants = np.minimum(np.maximum(np.tile(-2*np.arange(i), (mask_size, 1))
-                                                  + start_left[mask, np.newaxis], 0),
-                                       space_order)
-            right_variants = np.minimum(np.tile(2*np.arange(i), (mask_size, 1))
-                                        + start_right[mask, np.newaxis],
-                                        space_order)
-
-            # Iterate over left and right variants
-            eval_stencils = evaluate_stencils(df[mask], 'paired_right', i,
-                                              left_variants, right_variants,
-                                              space_order, stencils)
-
-            # Insert the stencils into the weight function
-            fill_weights(df[mask], eval_stencils, 'paired_right',
-                         weights, axis, n_pts=i)
-
-
-def get_component_weights(data, axis, function, deriv, stencils, eval_offset):
+        slots = np.arange(np.amax(n_pts))
+        # This is capped at space_order to prevent invalid variant numbers
+        left_variants = np.minimum(np.maximum(-2*slots + start_left[:, np.newaxis], 0),
+                                   space_order)
+        right_variants = np.minimum(2*slots + start_right[:, np.newaxis],
+                                    space_order)
+
+    else:
+        raise ValueError("Invalid point type")
+
+    # Points have differing numbers of stencils, so set invalid variant
+    # numbers in the unused slots (these stencils default to zero)
+    unused = slots >= n_pts[:, np.newaxis]
+    left_variants = np.where(unused, np.NaN, left_variants)
+    right_variants = np.where(unused, np.NaN, right_variants)
+
+    # Evaluate all the stencils for these points at once
+    eval_stencils = evaluate_stencils(df, point_type, n_pts[:, np.newaxis],
+                                      left_variants, right_variants,
+                                      space_order, stencils)
+
+    # Insert the stencils into the weight function
+    fill_weights(df, eval_stencils, point_type, weights, axis, n_pts=n_pts)
+
+
+def get_component_weights(data, axis, function, deriv, stencils, eval_offset,
+                          points=None):
     """
     Take a component of the distance field and return the associated weight
     function.
@@ -593,6 +669,8 @@ def get_component_weights(data, axis, function, deriv, stencils, eval_offset):
     eval_offset : float
         The relative offset at which the derivative should be evaluated.
         Used for setting the default fill stencil.
+    points : tuple of ndarray
+        The x, y, and z indices of boundary adjacent points. Optional.
 
     Returns
     -------
@@ -604,7 +682,8 @@ def get_component_weights(data, axis, function, deriv, stencils, eval_offset):
     f_grid = function.grid
     axis_dim = 'x' if axis == 0 else 'y' if axis == 1 else 'z'
 
-    full_data = get_data_inc_reciprocals(data, f_grid.spacing[axis], axis_dim, grid_offset)
+    full_data = get_data_inc_reciprocals(data, f_grid.spacing[axis], axis_dim,
+                                         grid_offset, points=points)
 
     add_distance_column(full_data)
 
@@ -618,7 +697,8 @@ def get_component_weights(data, axis, function, deriv, stencils, eval_offset):
     w_shape = f_grid.shape + (ncoeffs,)
     w_dims = f_grid.dimensions + (s_dim,)
 
-    w = Function(name='w_'+function.name+'_'+axis_dim, dimensions=w_dims, shape=w_shape)
+    w = Function(name='w_'+function.name+'_'+axis_dim, dimensions=w_dims, shape=w_shape,
+                 dtype=function.dtype)
 
     w.data[:] = standard_stencil(deriv, function.space_order, offset=eval_offset)
 
@@ -644,7 +724,8 @@ def get_component_weights(data, axis, function, deriv, stencils, eval_offset):
     return w
 
 
-def get_weights(data, function, deriv, bcs, eval_offsets=(0., 0., 0.)):
+def get_weights(data, function, deriv, bcs, eval_offsets=(0., 0., 0.), workers=None,
+                stencil_cache=None):
     """
     Get the modified stencil weights for a function and derivative given the
     axial distances.
@@ -662,28 +743,43 @@ def get_weights(data, function, deriv, bcs, eval_offsets=(0., 0., 0.)):
     eval_offsets : tuple of float
         The relative offsets at which derivatives should be evaluated for each
         axis.
+    workers : int
+        Number of processes over which to generate any stencils not already
+        generated this session or found in the cache. Optional. Default is to
+        generate them serially. Process start-up outweighs the generation
+        itself at low orders (serial is roughly 10x faster at order 4), so this
+        only pays off for high-order stencils.
+    stencil_cache : str
+        Path to a stencil cache (a pickled dictionary) from which previously
+        generated stencils are loaded and to which new ones are written.
+        Optional. Default is to generate stencils without caching them on
+        disk.
 
     Returns
     -------
     substitutions : Devito Substitutions
         The substitutions to be included in the devito equation
     """
-    cache = os.path.dirname(__file__) + '/extrapolation_cache.dat'
+    cache = os.path.dirname(os.path.dirname(__file__)) + '/extrapolation_cache.dat'
 
     # This wants to start as an empty list
     weights = []
     for axis in range(3):
-        # Check any != filler value in data[axis].data
+        axis_data = data[axis].data
+        # Locate any points != filler value in axis_data, reused downstream
         # TODO: Could just calculate this rather than finding the minimum
-        fill_val = np.amin(data[axis].data)
-        if np.any(data[axis].data != fill_val):
+        points = find_boundary_points(axis_data)
+        if points[0].size != 0:
             # If True, then behave as normal
             # If False then pass
-            stencils = get_stencils_lambda(deriv, eval_offsets[axis], bcs, cache=cache)
-
-            axis_weights = get_component_weights(data[axis].data, axis, function,
-                                                 deriv, stencils, eval_offsets[axis])
-            print(deriv, function, function.grid.dimensions[axis], axis_weights)
+            stencils = get_stencils_lambda(deriv, eval_offsets[axis], bcs, cache=cache,
+                                           workers=workers, stencil_cache=stencil_cache)
+
+            axis_weights = get_component_weights(axis_data, axis, function,
+                                                 deriv, stencils, eval_offsets[axis],
+                                                 points=points)
+            debug("Generated weights %s for derivative %d of %s along %s",
+                  axis_weights, deriv, function, function.grid.dimensions[axis])
             weights.append(Coefficient(deriv, function,
                                        function.grid.dimensions[axis],
                                        axis_weights))
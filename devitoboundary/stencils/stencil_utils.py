@@ -1,6 +1,11 @@
 import numpy as np
 import sympy as sp
-from devitoboundary.symbolics.symbols import a, n, n_max
+
+from functools import lru_cache
+from devitoboundary.symbolics.symbols import a, n, n_max, x_poly
+
+# Generic polynomial series used in the specification of boundary conditions
+_generic_polynomial = sp.Sum(a[n]*x_poly**n, (n, 0, n_max))
 
 
 def standard_stencil(deriv, space_order, offset=0., as_float=True):
@@ -25,11 +30,7 @@ def standard_stencil(deriv, space_order, offset=0., as_float=True):
     stencil_expr : sympy.Add
         The stencil expression
     """
-    # Want to start by calculating standard stencil expansions
-    min_index = -offset - space_order/2
-    x_list = [i + min_index for i in range(space_order+1)]
-
-    base_coeffs = sp.finite_diff_weights(deriv, x_list, 0)[-1][-1]
+    base_coeffs = _standard_weights(deriv, space_order, offset)
 
     if as_float:
         return np.array(base_coeffs, dtype=np.float32)
@@ -37,6 +38,19 @@ def standard_stencil(deriv, space_order, offset=0., as_float=True):
         return np.array(base_coeffs, dtype=object)
 
 
+@lru_cache(maxsize=None)
+def _standard_weights(deriv, space_order, offset):
+    """
+    Memoized standard finite-difference weights. Returned as a tuple so that
+    callers can build fresh arrays without mutating the cached values.
+    """
+    # Want to start by calculating standard stencil expansions
+    min_index = -offset - space_order/2
+    x_list = [i + min_index for i in range(space_order+1)]
+
+    return tuple(sp.finite_diff_weights(deriv, x_list, 0)[-1][-1])
+
+
 def generic_function(val, deriv=0):
     """
     Returns specified derivative of a polynomial series. To be used in the place
@@ -49,10 +63,7 @@ def generic_function(val, deriv=0):
     deriv : int
         The order of the derivative. Default is zero.
     """
-    x_poly = sp.symbols('x_poly')
-    polynomial = sp.Sum(a[n]*x_poly**n,
-                        (n, 0, n_max))
-    return sp.diff(polynomial, x_poly, deriv).subs(x_poly, val)
+    return sp.diff(_generic_polynomial, x_poly, deriv).subs(x_poly, val)
 
 
 def get_grid_offset(function, axis):
@@ -1,6 +1,13 @@
 import sympy as sp
 import numpy as np
+import os
 import pickle
+import stat
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import product
 
 from devito.logger import warning
 from devitoboundary.stencils.stencil_utils import standard_stencil
@@ -8,11 +15,25 @@ from devitoboundary.symbolics.symbols import (a, x_b, x_a, x_t, E, eta_l, eta_r)
 
 __all__ = ['taylor', 'BoundaryConditions', 'get_ext_coeffs', 'get_stencils', 'get_stencils_lambda']
 
+# Extrapolations (and the solves they are built from), substituted
+# extrapolations, and lambdified stencils already generated this session
+_ext_coeffs_cache = {}
+_ext_solve_cache = {}
+_ext_subs_cache = {}
+_stencils_lambda_cache = {}
+
+# Highest protocol readable by all supported Python versions (3.6+)
+_pickle_protocol = 4
+
+# Version of the stencil generator. Part of the stencil cache keys, so should
+# be incremented whenever the generated stencils change
+_stencil_version = 1
+
 
 def taylor(x, order):
     """Generate a taylor series expansion of a given order"""
-    n = sp.symbols('n')
-    polynomial = sp.Sum(a[n]*(x-x_b)**n, (n, 0, order)).doit()
+    # Order is known, so build the terms directly rather than via sp.Sum
+    polynomial = sp.Add(*[a[n]*(x-x_b)**n for n in range(order+1)])
     return polynomial
 
 
@@ -54,9 +75,16 @@ class BoundaryConditions:
         if order is None:
             order = self.order
         series = taylor(self._x, order)
-        for deriv, val in self._bcs.items():
-            series = series.subs(a[deriv], val/np.math.factorial(deriv))
-        return series
+        # Replace all the coefficients fixed by the bcs in a single pass
+        fixed = {a[deriv]: sp.sympify(val/np.math.factorial(deriv))
+                 for deriv, val in self._bcs.items()}
+        return series.xreplace(fixed)
+
+    @property
+    def _key(self):
+        """Hashable key identifying these bcs in the in-memory caches"""
+        return (tuple((deriv, sp.srepr(val)) for deriv, val in self._bcs.items()),
+                self._order)
 
     @property
     def bcs(self):
@@ -114,34 +142,243 @@ def get_ext_coeffs(bcs, cache=None):
             # Add new entry to dictionary
             coeff_cache[key] = coeff_dict
             # And update the cache
-            with open(cache, 'wb') as f:
-                pickle.dump(coeff_cache, f)
+            _write_cache(cache, coeff_cache)
 
         return coeff_dict
 
 
+def _write_cache(cache, contents):
+    """
+    Write a cache dictionary to file. Written to a uniquely named temporary
+    file first and then moved into place, so neither an interrupted write nor
+    concurrent writers can corrupt the cache.
+    """
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)),
+                                   suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(contents, f, protocol=_pickle_protocol)
+        # Keep the permissions of the cache being replaced (mkstemp is 0600)
+        if os.path.exists(cache):
+            os.chmod(tmp, stat.S_IMODE(os.stat(cache).st_mode))
+        os.replace(tmp, cache)
+    except OSError:
+        # Cache is only an optimisation, so carry on with the results in memory
+        warning("Unable to write to cache {}".format(cache))
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
 def _get_ext_coeffs(bcs):
     """Get the extrapolation coefficients for a set of boundary conditions"""
+    # Unique key for this extrapolation
+    key = bcs._key
+
+    # Only solve for a given extrapolation once
+    try:
+        return _ext_coeffs_cache[key]
+    except KeyError:
+        pass
+
     n_pts = bcs.order//2  # Number of interior points
     coeff_dict = {}  # Master coefficient dictionary
     for points_count in range(1, n_pts+1):
         # This -1 might want to be taken into account somewhere else
         taylor = bcs.get_taylor(order=2*points_count - 1)
-        lhs = sum([E[point]*taylor.subs(bcs.x, x_a[point]) for point in range(points_count)])
-        rhs = taylor.subs(bcs.x, x_t)
-        eqs = [sp.Eq(sp.expand(lhs).coeff(a[i], 1), sp.expand(rhs).coeff(a[i], 1)) for i in range(bcs.order+1)
-               if sp.Eq(lhs.coeff(a[i], 1), rhs.coeff(a[i], 1)) is not sp.true]
+        coeff_dict[points_count] = _solve_extrapolation(taylor, bcs.x, points_count)
 
-        # Variables to solve for
-        solve_vars = [E[point] for point in range(points_count)]
-        coeffs = sp.solve(eqs, solve_vars)
+    _ext_coeffs_cache[key] = coeff_dict
+    return coeff_dict
 
-        coeff_dict[points_count] = coeffs
 
-    return coeff_dict
+def _solve_extrapolation(taylor, x, points_count):
+    """
+    Solve for the extrapolation coefficients fitting a (truncated) taylor
+    series through a number of points. The solution only depends on the
+    series, so is shared between boundary conditions which differ only in
+    higher-order terms.
+    """
+    key = (taylor, points_count)
+    try:
+        return _ext_solve_cache[key]
+    except KeyError:
+        pass
+
+    lhs = sp.Add(*[E[point]*taylor.xreplace({x: x_a[point]}) for point in range(points_count)])
+    rhs = taylor.xreplace({x: x_t})
+
+    # Polynomial coefficients not fixed by the boundary conditions
+    unknowns = [a[i] for i in range(2*points_count) if taylor.has(a[i])]
+
+    # Match the terms in each unknown (extracted in a single pass per side)
+    if len(unknowns) > 0:
+        lhs_poly = sp.Poly(lhs, *unknowns)
+        rhs_poly = sp.Poly(rhs, *unknowns)
+        residuals = [lhs_poly.coeff_monomial(unknown) - rhs_poly.coeff_monomial(unknown)
+                     for unknown in unknowns]
+    else:
+        residuals = []
+
+    # Variables to solve for
+    solve_vars = [E[point] for point in range(points_count)]
+
+    # The residuals are linear in the solve variables, so use the linear
+    # solver rather than the general one (sp.solve)
+    solution = sp.linsolve(residuals, solve_vars)
+    if solution == sp.EmptySet:
+        coeffs = []
+    else:
+        # Drop free variables, matching the output of sp.solve
+        coeffs = {var: val for var, val in zip(solve_vars, solution.args[0])
+                  if val != var} or []
+
+    _ext_solve_cache[key] = coeffs
+    return coeffs
+
+
+def _get_unusable(variant):
+    """Get the number of unusable points on a side given the variant"""
+    return min(variant, variant//2 + 1)
+
+
+def _get_outside(variant):
+    """Get the number of exterior points on a side given the variant"""
+    return (variant + 1)//2
+
+
+def _get_available(left_unusable, right_unusable, left_outside, right_outside, s_o):
+    """
+    Get the positions of points available for the extrapolation on each side
+    given the number of unusable and exterior stencil points.
+    """
+    points = range(-s_o//2, s_o//2+1)
+    # Deal with -0 = 0 when indexing from right
+    if right_unusable == 0:
+        left_available = points[left_unusable:]
+        right_available = points[left_outside:]
+    else:
+        left_available = points[left_unusable:-right_outside]
+        right_available = points[left_outside:-right_unusable]
+    return left_available, right_available
+
+
+def _get_stencil_addition(outside, available, coeff_dict, s_o, base_stencil, side,
+                          memo=None):
+    """
+    Get the additions to the base stencil introduced by the extrapolations for a side.
+    Substituted extrapolations are stored in memo (if supplied) for reuse, as many
+    variants share the same extrapolation points.
+    """
+    if side != 'left' and side != 'right':
+        raise ValueError("Invalid side")
+
+    # No exterior points on this side, so nothing to extrapolate
+    if outside == 0:
+        return np.full(s_o+1, sp.Float(0))
+
+    half = s_o//2
+    n_available = len(available)
+    n_coeffs = half if n_available > half else n_available if n_available > 0 else 1
+
+    if side == 'left':
+        # Force use of middle point if nomianally no points are available
+        ext_points = tuple(available[:s_o]) if n_available > 0 else (0,)
+
+        # Build main substitutions
+        main_subs = {x_a[i]: sp.Integer(ext_points[i]) for i in range(n_coeffs)}
+
+        # Set floor on eta if necessary
+        if n_available > 0:
+            main_subs[x_b] = eta_l
+        else:
+            main_subs[x_b] = sp.Float(-0.5)
+    else:
+        # Force use of middle point if nomianally no points are available
+        ext_points = tuple(available[-s_o:]) if n_available > 0 else (0,)
+
+        # Build main substitutions (Index from right to left for this one)
+        main_subs = {x_a[i]: sp.Integer(ext_points[-1-i]) for i in range(n_coeffs)}
+
+        # Set floor on eta if necessary
+        if n_available > 0:
+            main_subs[x_b] = eta_r
+        else:
+            main_subs[x_b] = sp.Float(0.5)
+
+    # Apply main substitutions (xreplace as these are exact symbol swaps)
+    key = tuple(main_subs.items())
+    if memo is not None and key in memo:
+        ext_coeffs = memo[key]
+    else:
+        ext_coeffs = {coeff: val.xreplace(main_subs)
+                      for (coeff, val) in coeff_dict[n_coeffs].items()}
+        if memo is not None:
+            memo[key] = ext_coeffs
+
+    points = tuple(range(-s_o//2, half+1))
+
+    # Array containing additions to stencil
+    additions = np.full(s_o+1, sp.Float(0))
+
+    # Stencil indices receiving each extrapolation coefficient (loop invariant)
+    if side == 'left':
+        targets = [half + ext_points[position] for position in range(n_coeffs)]
+    else:
+        targets = [half + ext_points[-1-position] for position in range(n_coeffs)]
+
+    for point in range(outside):
+        # Exterior point being replaced and its weight in the base stencil
+        index = point if side == 'left' else -1-point
+        weight = base_stencil[index]
+
+        # Apply substitutions for x_t
+        point_coeffs = {coeff: val.xreplace({x_t: sp.Integer(points[index])})
+                        for (coeff, val) in ext_coeffs.items()}
+
+        # Loop over the coefficients and add them to the addition with the correct weighting
+        for position in range(n_coeffs):
+            additions[targets[position]] += weight*point_coeffs[E[position]]
+
+    return additions
+
+
+def _get_stencil_additions(left_outside, right_outside,
+                           left_available, right_available,
+                           coeff_dict, s_o, base_stencil, memo=None):
+    """
+    Get the additions to the base stencil introduced by the extrapolations
+    """
+    left_add = _get_stencil_addition(left_outside, left_available, coeff_dict,
+                                     s_o, base_stencil, 'left', memo=memo)
+    right_add = _get_stencil_addition(right_outside, right_available, coeff_dict,
+                                      s_o, base_stencil, 'right', memo=memo)
+
+    truncated_stencil = base_stencil.copy()
+    truncated_stencil[:left_outside] = sp.Float(0)
+    if right_outside != 0:
+        truncated_stencil[-right_outside:] = sp.Float(0)
+    stencil = truncated_stencil + left_add + right_add
+
+    return stencil
+
+
+def _get_variant_stencil(variants, coeff_dict, s_o, base_stencil, memo=None):
+    """Get the stencil for a given pair of (left, right) variants"""
+    left, right = variants
+    left_unusable = _get_unusable(left)
+    left_outside = _get_outside(left)
+    right_unusable = _get_unusable(right)
+    right_outside = _get_outside(right)
+    left_available, right_available = _get_available(left_unusable, right_unusable,
+                                                     left_outside, right_outside, s_o)
+
+    return _get_stencil_additions(left_outside, right_outside,
+                                  left_available, right_available,
+                                  coeff_dict, s_o, base_stencil, memo=memo)
 
 
-def get_stencils(deriv, offset, bcs, cache=None):
+def get_stencils(deriv, offset, bcs, cache=None, workers=None):
     """
     Get the array of stencils for a given specification
 
@@ -154,6 +391,10 @@ def get_stencils(deriv, offset, bcs, cache=None):
         The boundary conditions which these stencils are for
     cache : str
         Path to the extrapolation cache. Optional
+    workers : int
+        Number of processes over which to generate the stencil variants. Optional.
+        Default is to generate them serially. Only worthwhile for high-order
+        stencils, as process start-up outweighs the generation at low orders.
 
     Returns
     -------
@@ -161,111 +402,6 @@ def get_stencils(deriv, offset, bcs, cache=None):
         The array of stencils
 
     """
-    def get_unusable(variant):
-        """Get the number of unusable points on a side given the variant"""
-        return min(variant, int(variant/2+1))
-
-    def get_outside(variant):
-        """Get the number of exterior points on a side given the variant"""
-        return int(np.ceil(variant/2))
-
-    def get_available(left_unusable, right_unusable, left_outside, right_outside, s_o):
-        """
-        Get the positions of points available for the extrapolation on each side
-        given the number of unusable and exterior stencil points.
-        """
-        # Deal with -0 = 0 when indexing from right
-        if right_unusable == 0:
-            left_available = range(-s_o//2, s_o//2+1)[left_unusable:]
-            right_available = range(-s_o//2, s_o//2+1)[left_outside:]
-        else:
-            left_available = range(-s_o//2, s_o//2+1)[left_unusable:-right_outside]
-            right_available = range(-s_o//2, s_o//2+1)[left_outside:-right_unusable]
-        return left_available, right_available
-
-    def get_stencil_addition(outside, available, coeff_dict, s_o, base_stencil, side):
-        """
-        Get the additions to the base stencil introduced by the extrapolations for a side
-        """
-        if side != 'left' and side != 'right':
-            raise ValueError("Invalid side")
-
-        n_coeffs = s_o//2 if len(available) > s_o//2 else len(available) if len(available) > 0 else 1
-
-        if side == 'left':
-            # Force use of middle point if nomianally no points are available
-            ext_points = tuple(available[:s_o]) if len(available) > 0 else (0,)
-
-            # Build main substitutions
-            main_subs = [(x_a[i], ext_points[i]) for i in range(n_coeffs)]
-
-            # Set floor on eta if necessary
-            if len(available) > 0:
-                main_subs += [(x_b, eta_l)]
-            else:
-                main_subs += [(x_b, -0.5)]
-        else:
-            # Force use of middle point if nomianally no points are available
-            ext_points = tuple(available[-s_o:]) if len(available) > 0 else (0,)
-
-            # Build main substitutions (Index from right to left for this one)
-            main_subs = [(x_a[i], ext_points[-1-i]) for i in range(n_coeffs)]
-
-            # Set floor on eta if necessary
-            if len(available) > 0:
-                main_subs += [(x_b, eta_r)]
-            else:
-                main_subs += [(x_b, 0.5)]
-
-        # Apply main substitutions
-        ext_coeffs = coeff_dict[n_coeffs]
-        ext_coeffs = {coeff: val.subs(main_subs) for (coeff, val) in ext_coeffs.items()}
-
-        points = tuple(range(-s_o//2, s_o//2+1))
-
-        # Array containing additions to stencil
-        additions = np.full(s_o+1, sp.Float(0))
-
-        if side == 'left':
-            for point in range(outside):
-                # Apply substitutions for x_t
-                point_coeffs = {coeff: val.subs(x_t, points[point])
-                                for (coeff, val) in ext_coeffs.items()}
-
-                # Loop over the coefficients and add them to the addition with the correct weighting
-                for position in range(n_coeffs):
-                    additions[s_o//2 + ext_points[position]] += base_stencil[point]*point_coeffs[E[position]]
-        else:
-            for point in range(outside):
-                # Apply substitutions for x_t
-                point_coeffs = {coeff: val.subs(x_t, points[-1-point])
-                                for (coeff, val) in ext_coeffs.items()}
-
-                # Loop over the coefficients and add them to the addition with the correct weighting
-                for position in range(n_coeffs):
-                    additions[s_o//2 + ext_points[-1-position]] += base_stencil[-1-point]*point_coeffs[E[position]]
-
-        return additions
-
-    def get_stencil_additions(left_outside, right_outside,
-                              left_available, right_available,
-                              coeff_dict, s_o, base_stencil):
-        """
-        Get the additions to the base stencil introduced by the extrapolations
-        """
-        left_add = get_stencil_addition(left_outside, left_available, coeff_dict,
-                                        s_o, base_stencil, 'left')
-        right_add = get_stencil_addition(right_outside, right_available, coeff_dict,
-                                         s_o, base_stencil, 'right')
-
-        truncated_stencil = base_stencil.copy()
-        truncated_stencil[:left_outside] = sp.Float(0)
-        if right_outside != 0:
-            truncated_stencil[-right_outside:] = sp.Float(0)
-        stencil = truncated_stencil + left_add + right_add
-
-        return stencil
-
     s_o = bcs.order
     base_stencil = standard_stencil(deriv, s_o,
                                     offset=offset, as_float=False)
@@ -274,25 +410,93 @@ def get_stencils(deriv, offset, bcs, cache=None):
 
     coeff_dict = get_ext_coeffs(bcs, cache=cache)
 
-    # Loop over variants
-    for left in range(s_o + 1):
-        left_unusable = get_unusable(left)
-        left_outside = get_outside(left)
-        for right in range(s_o + 1):
-            right_unusable = get_unusable(right)
-            right_outside = get_outside(right)
-            left_available, right_available = get_available(left_unusable, right_unusable,
-                                                            left_outside, right_outside, s_o)
-
-            stencil = get_stencil_additions(left_outside, right_outside,
-                                            left_available, right_available,
-                                            coeff_dict, s_o, base_stencil)
-            stencil_array[left, right] = stencil
+    # All (left, right) variants. These are independent of one another
+    variants = list(product(range(s_o + 1), range(s_o + 1)))
+    gen_stencil = partial(_get_variant_stencil, coeff_dict=coeff_dict,
+                          s_o=s_o, base_stencil=base_stencil)
+
+    if workers is None or workers == 1:
+        # Variants share extrapolations, so substituted ones are memoized.
+        # These only depend on the extrapolation used, so are kept for
+        # stencils for other derivatives and offsets
+        memo = _ext_subs_cache.setdefault((bcs._key, cache), {})
+        stencils = map(partial(gen_stencil, memo=memo), variants)
+    else:
+        # Session memo is not sent to the workers (it would be pickled with
+        # every chunk and any updates lost), so each chunk starts afresh
+        gen_stencil = partial(gen_stencil, memo={})
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            stencils = list(executor.map(gen_stencil, variants,
+                                         chunksize=max(1, len(variants)//(4*workers))))
+
+    for (left, right), stencil in zip(variants, stencils):
+        stencil_array[left, right] = stencil
 
     return stencil_array
 
 
-def get_stencils_lambda(deriv, offset, bcs, cache=None):
+def _horner_form(expr):
+    """
+    Rearrange a stencil coefficient to reduce the number of operations required
+    to evaluate it. The extrapolations on each side only contribute terms in
+    their own eta, so each side is collected into a single fraction with
+    numerator and denominator in Horner form.
+    """
+    const, variable = expr.as_independent(eta_l, eta_r, as_Add=True)
+    left, right = variable.as_independent(eta_r, as_Add=True)
+
+    rearranged = const
+    for eta, side in ((eta_l, left), (eta_r, right)):
+        if side != 0:
+            numerator, denominator = sp.fraction(sp.together(side))
+            rearranged += (sp.horner(sp.expand(numerator), eta)
+                           / sp.horner(sp.expand(denominator), eta))
+    return rearranged
+
+
+def _get_rearranged_stencils(deriv, offset, bcs, cache=None, workers=None,
+                             stencil_cache=None):
+    """
+    Get the array of stencils in their rearranged (Horner) form, loading them
+    from the stencil cache where possible.
+    """
+    if stencil_cache is None:
+        stencils = get_stencils(deriv, offset, bcs, cache=cache, workers=workers)
+        return np.vectorize(_horner_form, otypes=[object])(stencils)
+
+    try:
+        with open(stencil_cache, 'rb') as f:
+            stencil_dict = pickle.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError("Invalid cache location")
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        # Truncated or corrupt cache, so start afresh (overwritten on write)
+        warning("Unable to read stencil cache. Generating new stencils")
+        stencil_dict = {}
+
+    if not isinstance(stencil_dict, dict):
+        raise TypeError("Specified file does not contain a dictionary")
+
+    # Unique key for these stencils (offset as float so 0 and 0. match)
+    key = (str(bcs), deriv, float(offset), _stencil_version)
+
+    try:
+        return stencil_dict[key]
+    except KeyError:
+        warning("Stencils not in cache. Generating new stencils")
+        stencils = get_stencils(deriv, offset, bcs, cache=cache, workers=workers)
+        stencils = np.vectorize(_horner_form, otypes=[object])(stencils)
+
+        # Add new entry to dictionary
+        stencil_dict[key] = stencils
+        # And update the cache
+        _write_cache(stencil_cache, stencil_dict)
+
+    return stencils
+
+
+def get_stencils_lambda(deriv, offset, bcs, cache=None, workers=None,
+                        stencil_cache=None):
     """
     Get the stencils as an array of functions which can be called on supplied values
     of eta_l and eta_r.
@@ -306,6 +510,12 @@ def get_stencils_lambda(deriv, offset, bcs, cache=None):
         The boundary conditions which these stencils are for
     cache : str
         Path to the extrapolation cache. Optional
+    workers : int
+        Number of processes over which to generate the stencil variants. Optional.
+        Only worthwhile for high-order stencils.
+    stencil_cache : str
+        Path to the stencil cache. Optional. Stencils found in this cache are
+        lambdified directly, skipping their generation.
 
     Returns
     -------
@@ -313,9 +523,21 @@ def get_stencils_lambda(deriv, offset, bcs, cache=None):
         The array of functions for each stencil coefficient. Indexed by [left variant, right variant, index].
 
     """
-    stencils = get_stencils(deriv, offset, bcs, cache=cache)
+    # Unique key for these stencils
+    key = (bcs._key, deriv, offset)
+
+    # Stencils are reused across axes and derivatives, so only generate once
+    try:
+        return _stencils_lambda_cache[key]
+    except KeyError:
+        pass
+
+    stencils = _get_rearranged_stencils(deriv, offset, bcs, cache=cache,
+                                        workers=workers,
+                                        stencil_cache=stencil_cache)
     funcs = np.empty(stencils.shape, dtype=object)
     for i in range(stencils.size):
-        # Add a lambdaify in here
         funcs.flat[i] = sp.lambdify([eta_l, eta_r], stencils.flat[i])
+
+    _stencils_lambda_cache[key] = funcs
     return funcs
@@ -16,6 +16,7 @@ n, n_max = sp.symbols('n, n_max')
 x_b, x_r, x_l = sp.symbols('x_b, x_r, x_l')
 
 x_c = sp.symbols('x_c')  # Continuous x
+x_poly = sp.symbols('x_poly')  # Variable of the generic polynomial
 f = sp.IndexedBase('f')  # Function values at particular points
 h_x = sp.symbols('h_x')  # Grid spacing
 # Distance to boundary in grid increments
@@ -74,13 +74,14 @@ class ImmersedBoundary:
         # Create the axial distance function
         ax = AxialDistanceFunction(first.function, self._surface)
 
-        # Empty tuple for weights
-        weights = ()
+        # Empty list for weights
+        weights = []
 
         for i, row in group.iterrows():
             derivative = row.derivative
             eval_offset = row.eval_offset
-            weights += get_weights(ax.axial, function, derivative, bcs, eval_offsets=eval_offset)
+            weights.extend(get_weights(ax.axial, function, derivative, bcs,
+                                       eval_offsets=eval_offset))
 
         return weights
 
@@ -117,11 +118,10 @@ class ImmersedBoundary:
 
         grouped = derivs.groupby('name')
 
-        weights = ()
+        weights = []
 
         for name, group in grouped:
             # Loop over items in each group and call a function
-            func_weights = self._get_function_weights(group)
-            weights += func_weights
+            weights.extend(self._get_function_weights(group))
 
         return Substitutions(*weights)
@@ -76,14 +76,20 @@ stencil = solve(eq.evaluate, u.forward)
 # Our injection term
 src_term = src.inject(field=u.forward, expr=src*dt**2/VP)
 
-# Now create our operator
-op = Operator([Eq(u.forward, stencil)] + [Eq(usave, u)] + src_term)
+# Now create our operator (OpenMP parallel with two levels of cache blocking)
+op = Operator([Eq(u.forward, stencil)] + [Eq(usave, u)] + src_term,
+              opt=('advanced', {'openmp': True, 'blocklevels': 2}))
 
-# And run
-op.apply(dt=dt)
+# And run (autotuning the block sizes)
+op.apply(dt=dt, autotune='aggressive')
 
+# Write the snapshots straight into a memory-mapped .npy file
 outfile = 'data/seismic_topography_wavefield.npy'
-np.save(outfile, usave.data)
+wavefield = np.lib.format.open_memmap(outfile, mode='w+', dtype=usave.dtype,
+                                      shape=usave.data.shape)
+wavefield[:] = usave.data
+wavefield.flush()
+del wavefield
 """
 plot_extent = [0, grid.extent[0],
                origin[2], grid.extent[2] + origin[2]]
@@ -113,3 +113,49 @@ class TestError:
         if mean_err > thres:
             message = "Mean error greater than threshold: {}"
             raise ValueError(message.format(mean_err))
+
+
+class TestCache:
+    """A class to test caching of generated signed distance functions"""
+
+    def test_sdf_cache(self, tmpdir):
+        """Check that a cached SDF is written and matches a fresh one"""
+        sphere = 'tests/trial_surfaces/sphere.ply'
+
+        grid = Grid(shape=(101, 101, 101), extent=(100., 100., 100.))
+        f = Function(name='f', grid=grid, space_order=4)
+
+        generated = SignedDistanceFunction(f, sphere, cache=str(tmpdir))
+        assert len(tmpdir.listdir()) == 1
+
+        cached = SignedDistanceFunction(f, sphere, cache=str(tmpdir))
+        assert len(tmpdir.listdir()) == 1
+        assert np.all(cached.sdf.data == generated.sdf.data)
+
+    def test_corrupt_cache(self, tmpdir):
+        """Check that a truncated cache entry is regenerated"""
+        sphere = 'tests/trial_surfaces/sphere.ply'
+
+        grid = Grid(shape=(11, 11, 11), extent=(10., 10., 10.))
+        f = Function(name='f', grid=grid, space_order=4)
+
+        generated = SignedDistanceFunction(f, sphere, cache=str(tmpdir))
+        entry = tmpdir.listdir()[0]
+        entry.write_binary(entry.read_binary()[:100])
+
+        regenerated = SignedDistanceFunction(f, sphere, cache=str(tmpdir))
+        assert len(tmpdir.listdir()) == 1
+        assert np.all(regenerated.sdf.data == generated.sdf.data)
+
+        cached = SignedDistanceFunction(f, sphere, cache=str(tmpdir))
+        assert np.all(cached.sdf.data == generated.sdf.data)
+
+    def test_invalid_cache(self):
+        """Check that a missing cache directory raises an error"""
+        sphere = 'tests/trial_surfaces/sphere.ply'
+
+        grid = Grid(shape=(11, 11, 11), extent=(10., 10., 10.))
+        f = Function(name='f', grid=grid, space_order=4)
+
+        with pytest.raises(FileNotFoundError):
+            SignedDistanceFunction(f, sphere, cache='not/a/directory')
@@ -1,15 +1,19 @@
 import pytest
 import os
+import pickle
 
 import numpy as np
 import pandas as pd
+from importlib import import_module
 from devitoboundary.stencils.evaluation import (get_data_inc_reciprocals,
                                                 split_types, add_distance_column,
                                                 get_component_weights,
                                                 find_boundary_points, evaluate_stencils,
-                                                get_variants, apply_grid_offset)
+                                                get_variants, apply_grid_offset,
+                                                get_line_ends, consolidate_points,
+                                                get_weights)
 from devitoboundary.stencils.stencils import BoundaryConditions, get_stencils_lambda
-from devito import Grid, Function, Dimension
+from devito import Grid, Function, VectorFunction, Dimension
 
 
 class TestDistances:
@@ -113,6 +117,50 @@ class TestDistances:
         assert(np.all(paired_left.index.get_level_values(xyz[axis]).to_numpy() == 3))
         assert(np.all(paired_right.index.get_level_values(xyz[axis]).to_numpy() == 5))
 
+    @pytest.mark.parametrize('axis', [0, 1, 2])
+    def test_line_ends(self, axis):
+        """
+        A test to check that the ends of each grid line are found in agreement
+        with a grouped head and tail.
+        """
+        xyz = ('x', 'y', 'z')
+        distances = np.full((10, 10, 10), -2, dtype=float)
+        # Irregular set of boundary-adjacent points
+        rng = np.random.default_rng(seed=0)
+        mask = rng.random(distances.shape) < 0.2
+        distances[mask] = 0.4
+
+        data = get_data_inc_reciprocals(distances, 1, xyz[axis], 0)
+
+        levels = ['z', 'y', 'x']
+        levels.remove(xyz[axis])
+
+        first_mask, last_mask = get_line_ends(data, xyz[axis], levels)
+
+        grouped = data.groupby(level=levels)
+        assert np.all(first_mask == data.index.isin(grouped.head(1).index))
+        assert np.all(last_mask == data.index.isin(grouped.tail(1).index))
+
+    def test_consolidate_points(self):
+        """
+        A test to check that duplicated points are consolidated in agreement
+        with a grouped aggregation, including points outside the grid.
+        """
+        rng = np.random.default_rng(seed=0)
+        eta_l = rng.random(500)
+        eta_l[rng.random(500) < 0.5] = np.NaN
+        df = pd.DataFrame({'x': rng.integers(-1, 6, 500),
+                           'y': rng.integers(0, 6, 500),
+                           'z': rng.integers(0, 6, 500),
+                           'eta_l': eta_l,
+                           'eta_r': rng.random(500)})
+
+        consolidated = consolidate_points(df, reduce_l=np.fmax)
+        grouped = df.groupby(['z', 'y', 'x']).agg({'eta_l': 'max', 'eta_r': 'min'})
+
+        assert consolidated.index.equals(grouped.index)
+        assert np.allclose(consolidated.to_numpy(), grouped.to_numpy(), equal_nan=True)
+
 
 class TestStencils:
     """
@@ -372,3 +420,51 @@ class TestStencils:
 
         for i in range(10):
             check_row(w.data, i, stencils_lambda)
+
+    def test_get_weights_stencil_cache(self, tmpdir, monkeypatch):
+        """
+        Check that get_weights only uses a stencil cache when one is supplied,
+        and that cached stencils give the same weights as generated ones.
+        """
+        order = 4
+        spec = {2*i: 0 for i in range(1+order//2)}
+        bcs = BoundaryConditions(spec, order)
+
+        grid = Grid(shape=(10, 10, 10), extent=(9., 9., 9.))
+        function = Function(name='function', grid=grid, space_order=order)
+        data = VectorFunction(name='data', grid=grid, space_order=order)
+        for axis in range(3):
+            ind = [slice(None), slice(None), slice(None)]
+            ind[axis] = np.array([1, 2, 5])
+            data[axis].data[:] = -2
+            data[axis].data[ind[0], ind[1], ind[2]] = 0.6
+
+        cache = str(tmpdir.join('stencil_cache.dat'))
+        with open(cache, 'wb') as f:
+            pickle.dump({}, f)
+
+        package_cache = os.path.dirname(__file__) + '/../devitoboundary/stencil_cache.dat'
+        with open(package_cache, 'rb') as f:
+            package_contents = f.read()
+
+        # Clear stencils lambdified earlier in the session, so that each call
+        # has to either generate them or load them from the cache
+        stencils_module = import_module('devitoboundary.stencils.stencils')
+        monkeypatch.setattr(stencils_module, '_stencils_lambda_cache', {})
+        generated = get_weights(data, function, 2, bcs)
+
+        with open(package_cache, 'rb') as f:
+            assert f.read() == package_contents
+
+        monkeypatch.setattr(stencils_module, '_stencils_lambda_cache', {})
+        written = get_weights(data, function, 2, bcs, stencil_cache=cache)
+
+        with open(cache, 'rb') as f:
+            assert len(pickle.load(f)) == 1
+
+        monkeypatch.setattr(stencils_module, '_stencils_lambda_cache', {})
+        cached = get_weights(data, function, 2, bcs, stencil_cache=cache)
+
+        for gen, wri, cac in zip(generated, written, cached):
+            assert np.all(np.isclose(wri.weights.data, gen.weights.data))
+            assert np.all(np.isclose(cac.weights.data, gen.weights.data))
@@ -1,11 +1,13 @@
 import pytest
+import os
 
 import numpy as np
 import sympy as sp
 import pickle
 
 from devitoboundary.stencils.stencils import (taylor, BoundaryConditions, get_ext_coeffs,
-                                              get_stencils_lambda)
+                                              get_stencils, get_stencils_lambda,
+                                              _get_rearranged_stencils)
 from devitoboundary.symbolics.symbols import x_a, x_t, x_b, E
 
 
@@ -110,27 +112,28 @@ class TestExtrapolations:
         assert sp.simplify(extrapolation - exterior) == 0
 
     @pytest.mark.parametrize('order', [2, 4])
-    def test_caching_write(self, order):
+    def test_caching_write(self, order, tmpdir):
         """Test that caching writes correctly"""
         spec = {2*i: 0 for i in range(order)}
         bcs = BoundaryConditions(spec, order)
 
-        # Reset the test cache
-        with open('tests/test_extrapolation_cache_w.dat', 'wb') as f:
+        # Start from an empty test cache (in tmpdir, to leave the repo untouched)
+        cache = str(tmpdir.join('test_extrapolation_cache_w.dat'))
+        with open(cache, 'wb') as f:
             pickle.dump({}, f)
 
         # Write an extrapolation
-        write_extrapolation = get_ext_coeffs(bcs, cache='tests/test_extrapolation_cache_w.dat')
+        write_extrapolation = get_ext_coeffs(bcs, cache=cache)
 
         # Write an extrapolation of order+2
         high_spec = {2*i: 0 for i in range(order+2)}
         high_bcs = BoundaryConditions(high_spec, order+2)
 
-        high_write_extrapolation = get_ext_coeffs(high_bcs, cache='tests/test_extrapolation_cache_w.dat')
+        high_write_extrapolation = get_ext_coeffs(high_bcs, cache=cache)
 
         # Read both extrapolations again and check
-        cached_extrapolation = get_ext_coeffs(bcs, cache='tests/test_extrapolation_cache_w.dat')
-        high_cached_extrapolation = get_ext_coeffs(high_bcs, cache='tests/test_extrapolation_cache_w.dat')
+        cached_extrapolation = get_ext_coeffs(bcs, cache=cache)
+        high_cached_extrapolation = get_ext_coeffs(high_bcs, cache=cache)
 
         assert write_extrapolation == cached_extrapolation
         assert high_write_extrapolation == high_cached_extrapolation
@@ -199,3 +202,75 @@ class TestStencils:
                 errors.append(err)
 
         assert np.median(errors) < thres
+
+    @pytest.mark.parametrize('offset', [0., 0.5])
+    def test_parallel_stencils(self, offset):
+        """Test that stencils generated over several processes match serial ones"""
+        spec = {2*i: 0 for i in range(3)}
+        bcs = BoundaryConditions(spec, 4)
+
+        serial = get_stencils(2, offset, bcs)
+        parallel = get_stencils(2, offset, bcs, workers=2)
+
+        assert parallel.shape == serial.shape
+        for ser, par in zip(serial.flat, parallel.flat):
+            assert ser == par
+
+    def test_stencil_caching(self, tmpdir):
+        """Test that stencils are written to and read from the stencil cache"""
+        cache = str(tmpdir.join('stencil_cache.dat'))
+        with open(cache, 'wb') as f:
+            pickle.dump({}, f)
+
+        spec = {2*i: 0 for i in range(2)}
+        bcs = BoundaryConditions(spec, 2)
+
+        written = _get_rearranged_stencils(1, 0, bcs, stencil_cache=cache)
+        cached = _get_rearranged_stencils(1, 0, bcs, stencil_cache=cache)
+
+        with open(cache, 'rb') as f:
+            assert len(pickle.load(f)) == 1
+
+        for write, read in zip(written.flat, cached.flat):
+            assert sp.simplify(write - read) == 0
+
+    def test_stencil_cache_corrupt(self, tmpdir):
+        """Test that a truncated stencil cache is regenerated and overwritten"""
+        cache = str(tmpdir.join('stencil_cache.dat'))
+        with open(cache, 'wb') as f:
+            pickle.dump({'entry': np.zeros(100)}, f)
+        with open(cache, 'rb') as f:
+            contents = f.read()
+        with open(cache, 'wb') as f:
+            f.write(contents[:len(contents)//2])
+
+        spec = {2*i: 0 for i in range(2)}
+        bcs = BoundaryConditions(spec, 2)
+
+        stencils = _get_rearranged_stencils(1, 0, bcs, stencil_cache=cache)
+        assert stencils.shape == (3, 3, 3)
+
+        with open(cache, 'rb') as f:
+            assert len(pickle.load(f)) == 1
+
+    def test_stencil_cache_unwritable(self, tmpdir, monkeypatch):
+        """Test that a failed cache write falls back to the generated stencils"""
+        cache = str(tmpdir.join('stencil_cache.dat'))
+        with open(cache, 'wb') as f:
+            pickle.dump({}, f)
+
+        def fail(*args):
+            raise PermissionError("Read-only cache")
+
+        monkeypatch.setattr(os, 'replace', fail)
+
+        spec = {2*i: 0 for i in range(2)}
+        bcs = BoundaryConditions(spec, 2)
+
+        stencils = _get_rearranged_stencils(1, 0, bcs, stencil_cache=cache)
+        assert stencils.shape == (3, 3, 3)
+
+        # Cache left untouched and no temporary file left behind
+        with open(cache, 'rb') as f:
+            assert len(pickle.load(f)) == 0
+        assert len(tmpdir.listdir()) == 1